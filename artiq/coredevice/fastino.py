@@ -1,6 +1,7 @@
 """RTIO driver for the Fastino 32-channel, 16-bit, 2.5 MS/s per channel
 streaming DAC.
 """
+import numpy as np
 from numpy import int32, int64
 
 from artiq.language.core import kernel, portable, delay, delay_mu
@@ -10,6 +11,36 @@ from artiq.language.units import ns
 from artiq.language.types import TInt32, TList
 
 
+# DAC machine units per volt
+_V_TO_MU_SCALE = 0x8000/10.
+
+
+@portable
+def _bit_length(x):
+    """Number of bits required to represent a non-negative 32-bit integer.
+
+    Kernel equivalent of :meth:`int.bit_length` using a fixed number of
+    steps.
+    """
+    n = 0
+    if x >> 16:
+        x >>= 16
+        n += 16
+    if x >> 8:
+        x >>= 8
+        n += 8
+    if x >> 4:
+        x >>= 4
+        n += 4
+    if x >> 2:
+        x >>= 2
+        n += 2
+    if x >> 1:
+        x >>= 1
+        n += 1
+    return n + x
+
+
 class Fastino:
     """Fastino 32-channel, 16-bit, 2.5 MS/s per channel streaming DAC
 
@@ -41,12 +72,24 @@ class Fastino:
     :param log2_width: Width of DAC channel group (logarithm base 2).
         Value must match the corresponding value in the RTIO PHY (gateware).
     """
-    kernel_invariants = {"core", "channel", "width", "t_frame"}
+    kernel_invariants = {"core", "channel", "width", "t_frame", "_width_mask",
+                         "_addr_update", "_addr_hold", "_addr_cfg",
+                         "_addr_leds", "_addr_continuous", "_addr_stage_cic",
+                         "_addr_apply_cic"}
 
     def __init__(self, dmgr, channel, core_device="core", log2_width=0):
         self.channel = channel << 8
         self.core = dmgr.get(core_device)
         self.width = 1 << log2_width
+        self._width_mask = self.width - 1
+        # RTIO targets of the configuration registers
+        self._addr_update = self.channel | 0x20
+        self._addr_hold = self.channel | 0x21
+        self._addr_cfg = self.channel | 0x22
+        self._addr_leds = self.channel | 0x23
+        self._addr_continuous = self.channel | 0x25
+        self._addr_stage_cic = self.channel | 0x26
+        self._addr_apply_cic = self.channel | 0x27
         # frame duration in mu (14 words each 7 clock cycles each 4 ns)
         # self.core.seconds_to_mu(14*7*4*ns)  # unfortunately this may round wrong
         assert self.core.ref_period == 1*ns
@@ -98,6 +141,65 @@ class Fastino:
         """
         rtio_output(self.channel | addr, data)
 
+    @kernel
+    def begin_batch(self, batch):
+        """Start staging configuration register writes in a batch.
+
+        The batch is a list of 9 ``int32`` owned by the caller (e.g.
+        ``[int32(0)] * 9``): one value for each configuration register
+        (addresses 0x20 to 0x27) followed by a bit mask of the registers
+        staged. Writes are staged with :meth:`batch_write` and submitted
+        with :meth:`end_batch`. The register methods (:meth:`update`,
+        :meth:`set_hold`, etc.) are not affected and always write
+        immediately.
+
+        This method does not advance the timeline.
+
+        :param batch: Batch list to clear.
+        """
+        batch[8] = 0
+
+    @kernel
+    def batch_write(self, batch, addr, data):
+        """Stage a configuration register write in a batch.
+
+        Only the last value staged for each register is kept.
+
+        :param batch: Batch list, see :meth:`begin_batch`.
+        :param addr: Configuration register address: 0x20 (update),
+            0x21 (hold), 0x22 (configuration bits), 0x23 (LEDs),
+            0x25 (continuous), 0x26 (CIC stage), 0x27 (CIC apply).
+        :param data: Data to write.
+        """
+        if (addr & ~7) != 0x20:
+            raise ValueError("Invalid configuration register address")
+        batch[addr & 7] = data
+        batch[8] |= 1 << (addr & 7)
+
+    @kernel
+    def end_batch(self, batch):
+        """Submit the configuration register writes staged in a batch.
+
+        Each staged register is written once, in address order, with
+        successive writes one coarse RTIO period apart so that they land
+        in the same or the next frame. The batch is cleared.
+        The update (0x20) and CIC apply (0x27) registers must not be staged
+        in the same batch.
+
+        This method advances the timeline by one coarse RTIO period per
+        register written.
+
+        :param batch: Batch list, see :meth:`begin_batch`.
+        """
+        mask = batch[8]
+        batch[8] = 0
+        if (mask & 0x81) == 0x81:
+            raise ValueError("update and apply_cic in the same batch")
+        for i in range(8):
+            if mask & (1 << i):
+                rtio_output(self._addr_update | i, batch[i])
+                delay_mu(int64(self.core.ref_multiplier))
+
     @kernel
     def read(self, addr):
         """Read from Fastino register.
@@ -132,7 +234,7 @@ class Fastino:
             If the list length is less than group size, the remaining
             DAC channels within the group are cleared to 0 (machine units).
         """
-        if dac & (self.width - 1):
+        if dac & self._width_mask:
             raise ValueError("Group index LSBs must be zero")
         rtio_output_wide(self.channel | dac, data)
 
@@ -143,8 +245,9 @@ class Fastino:
         :param voltage: Voltage in SI volts.
         :return: DAC data word in machine units, 16-bit integer.
         """
-        data = int32(round((0x8000/10.)*voltage)) + int32(0x8000)
-        if data < 0 or data > 0xffff:
+        data = int32(round(_V_TO_MU_SCALE*voltage)) + int32(0x8000)
+        # single test for both data < 0 and data > 0xffff
+        if data & ~0xffff:
             raise ValueError("DAC voltage out of bounds")
         return data
 
@@ -152,15 +255,69 @@ class Fastino:
     def voltage_group_to_mu(self, voltage, data):
         """Convert SI volts to packed DAC channel group machine units.
 
-        :param voltage: List of SI volt voltages.
+        :param voltage: List of SI volt voltages. Its length must be even.
         :param data: List of DAC channel data pairs to write to.
             Half the length of `voltage`.
         """
-        for i in range(len(voltage)):
-            v = self.voltage_to_mu(voltage[i])
-            if i & 1:
-                v = data[i // 2] | (v << 16)
-            data[i // 2] = int32(v)
+        if len(voltage) & 1:
+            raise ValueError("Number of voltages must be even")
+        for i in range(len(voltage) // 2):
+            lo = self.voltage_to_mu(voltage[2*i])
+            hi = self.voltage_to_mu(voltage[2*i + 1])
+            data[i] = int32(lo | (hi << 16))
+
+    def build_mu_table(self, voltage):
+        """Convert an array of SI volts to DAC machine units on the host.
+
+        This is intended to precompute a table of DAC words for a fixed set
+        of voltages outside of kernels (e.g. in ``prepare()``) so that
+        kernels can pass the table entries to :meth:`set_dac_mu` without
+        any floating point conversion. It cannot be called from kernels.
+
+        :param voltage: Array of SI volt voltages.
+        :return: ``int32`` array of DAC data words in machine units, 16-bit
+            unsigned, of the same shape as `voltage`.
+        """
+        voltage = np.asarray(voltage, dtype=np.float64)
+        mu = np.rint(voltage*_V_TO_MU_SCALE).astype(np.int32) + 0x8000
+        if np.any((mu < 0) | (mu > 0xffff)):
+            raise ValueError("DAC voltage out of bounds")
+        return mu
+
+    def voltage_group_to_mu_array(self, voltage, data=None):
+        """Convert SI volts to packed DAC channel group machine units on the
+        host.
+
+        This is a vectorized counterpart of :meth:`voltage_group_to_mu` for
+        preparing DAC data in bulk outside of kernels (e.g. in ``prepare()``).
+        It cannot be called from kernels. Use ``data.tolist()`` to obtain
+        a list suitable for :meth:`set_group_mu`.
+
+        Multiple groups (e.g. the frames of a waveform) can be converted
+        in one call by passing a two-dimensional array with one group
+        per row.
+
+        :param voltage: Array of SI volt voltages. Channels are along the
+            last axis, whose length must be even.
+        :param data: Optional ``int32`` array, with the last axis half the
+            length of that of `voltage`, to write the DAC channel data pairs
+            to. Passing the same array on every call avoids allocating a new
+            result array each time.
+        :return: Array of DAC channel data pairs (2x16-bit unsigned packed
+            into ``int32``), with the last axis half the length of that of
+            `voltage` (`data` if given).
+        """
+        mu = self.build_mu_table(voltage)
+        if mu.shape[-1] & 1:
+            raise ValueError("Number of voltages must be even")
+        shape = mu.shape[:-1] + (mu.shape[-1] // 2,)
+        if data is None:
+            data = np.empty(shape, dtype=np.int32)
+        elif data.shape != shape:
+            raise ValueError("data must have shape {}".format(shape))
+        np.left_shift(mu[..., 1::2], 16, out=data)
+        np.bitwise_or(data, mu[..., 0::2], out=data)
+        return data
 
     @kernel
     def set_dac(self, dac, voltage):
@@ -188,7 +345,7 @@ class Fastino:
 
         :param update: Bit mask of channels to update (32-bit).
         """
-        self.write(0x20, update)
+        rtio_output(self._addr_update, update)
 
     @kernel
     def set_hold(self, hold):
@@ -196,7 +353,7 @@ class Fastino:
 
         :param hold: Bit mask of channels to hold (32-bit).
         """
-        self.write(0x21, hold)
+        rtio_output(self._addr_hold, hold)
 
     @kernel
     def set_cfg(self, reset=0, afe_power_down=0, dac_clr=0, clr_err=0):
@@ -210,8 +367,8 @@ class Fastino:
             This clears the sticky red error LED. Must be cleared to enable
             error counting.
         """
-        self.write(0x22, (reset << 0) | (afe_power_down << 1) |
-                   (dac_clr << 2) | (clr_err << 3))
+        rtio_output(self._addr_cfg, (reset << 0) | (afe_power_down << 1) |
+                    (dac_clr << 2) | (clr_err << 3))
 
     @kernel
     def set_leds(self, leds):
@@ -220,14 +377,14 @@ class Fastino:
         :param leds: LED status, 8-bit integer each bit corresponding to one
             green LED.
         """
-        self.write(0x23, leds)
+        rtio_output(self._addr_leds, leds)
 
     @kernel
     def set_continuous(self, channel_mask):
         """Enable continuous DAC updates on channels regardless of new data
         being submitted.
         """
-        self.write(0x25, channel_mask)
+        rtio_output(self._addr_continuous, channel_mask)
 
     @kernel
     def stage_cic_mu(self, rate_mantissa, rate_exponent, gain_exponent):
@@ -240,7 +397,37 @@ class Fastino:
         if gain_exponent < 0 or gain_exponent >= 1 << 6:
             raise ValueError("gain_exponent out of bounds")
         config = rate_mantissa | (rate_exponent << 6) | (gain_exponent << 10)
-        self.write(0x26, config)
+        rtio_output(self._addr_stage_cic, config)
+
+    @portable
+    def cic_config_mu(self, rate):
+        """Compute machine unit interpolator configuration.
+
+        See :meth:`stage_cic` for the approximation of the rate and the gain
+        compensation. The result can be computed ahead of time (e.g. in
+        ``prepare()``) and passed to :meth:`stage_cic_mu` for rates that
+        do not change.
+
+        :param rate: Desired interpolation rate (1 to 65536).
+        :return: Tuple of ``rate_mantissa``, ``rate_exponent`` and
+            ``gain_exponent``, in the format of :meth:`stage_cic_mu`.
+        """
+        if rate <= 0 or rate > 1 << 16:
+            raise ValueError("rate out of bounds")
+        rate_exponent = max(0, _bit_length(rate) - 7)
+        rate_mantissa = rate >> rate_exponent
+        if rate_mantissa > 1 << 6:
+            rate_exponent += 1
+            rate_mantissa >>= 1
+        order = 3
+        # rate_mantissa ** order, integer ** is evaluated in floating point
+        # on the core device
+        gain = rate_mantissa*rate_mantissa*rate_mantissa
+        # ceil(log2(gain))
+        gain_exponent = _bit_length(gain - 1)
+        gain_exponent += order*rate_exponent
+        assert gain_exponent <= order*16
+        return rate_mantissa - 1, rate_exponent, gain_exponent
 
     @kernel
     def stage_cic(self, rate) -> TInt32:
@@ -259,24 +446,10 @@ class Fastino:
 
         Returns the actual interpolation rate.
         """
-        if rate <= 0 or rate > 1 << 16:
-            raise ValueError("rate out of bounds")
-        rate_mantissa = rate
-        rate_exponent = 0
-        while rate_mantissa > 1 << 6:
-            rate_exponent += 1
-            rate_mantissa >>= 1
-        order = 3
-        gain = 1
-        for i in range(order):
-            gain *= rate_mantissa
-        gain_exponent = 0
-        while gain > 1 << gain_exponent:
-            gain_exponent += 1
-        gain_exponent += order*rate_exponent
-        assert gain_exponent <= order*16
-        self.stage_cic_mu(rate_mantissa - 1, rate_exponent, gain_exponent)
-        return rate_mantissa << rate_exponent
+        rate_mantissa_mu, rate_exponent, gain_exponent = \
+            self.cic_config_mu(rate)
+        self.stage_cic_mu(rate_mantissa_mu, rate_exponent, gain_exponent)
+        return (rate_mantissa_mu + 1) << rate_exponent
 
     @kernel
     def apply_cic(self, channel_mask):
@@ -302,4 +475,4 @@ class Fastino:
         If application of new interpolator settings results in a change of the
         overall gain, there will be a corresponding output step.
         """
-        self.write(0x27, channel_mask)
+        rtio_output(self._addr_apply_cic, channel_mask)
@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+from numpy import int32
+
+from artiq.coredevice.fastino import Fastino, _bit_length
+
+
+class _DummyCore:
+    ref_period = 1e-9
+
+
+class _DummyDeviceManager:
+    def get(self, name):
+        return _DummyCore()
+
+
+def _cic_config_reference(rate):
+    # shift-by-one loops originally used by Fastino.stage_cic()
+    rate_mantissa = rate
+    rate_exponent = 0
+    while rate_mantissa > 1 << 6:
+        rate_exponent += 1
+        rate_mantissa >>= 1
+    order = 3
+    gain = 1
+    for i in range(order):
+        gain *= rate_mantissa
+    gain_exponent = 0
+    while gain > 1 << gain_exponent:
+        gain_exponent += 1
+    gain_exponent += order*rate_exponent
+    return rate_mantissa - 1, rate_exponent, gain_exponent
+
+
+class FastinoCase(unittest.TestCase):
+    def setUp(self):
+        self.fastino = Fastino(_DummyDeviceManager(), 0, log2_width=5)
+
+    def test_bit_length(self):
+        for x in range(1 << 20):
+            self.assertEqual(_bit_length(x), x.bit_length())
+        for x in (1 << 20, (1 << 31) - 1):
+            self.assertEqual(_bit_length(x), x.bit_length())
+
+    def test_cic_config_mu(self):
+        for rate in range(1, (1 << 16) + 1):
+            self.assertEqual(self.fastino.cic_config_mu(rate),
+                             _cic_config_reference(rate))
+
+    def test_cic_config_mu_bounds(self):
+        for rate in (0, -1, (1 << 16) + 1):
+            with self.assertRaises(ValueError):
+                self.fastino.cic_config_mu(rate)
+
+    def test_voltage_group_to_mu_array(self):
+        voltage = np.linspace(-10., 9.9, 32)
+        data = [int32(0)] * 16
+        self.fastino.voltage_group_to_mu(voltage, data)
+        data_array = self.fastino.voltage_group_to_mu_array(voltage)
+        self.assertEqual(data_array.dtype, np.int32)
+        np.testing.assert_array_equal(data_array, np.array(data))
+
+    def test_voltage_group_to_mu_array_2d(self):
+        voltage = np.linspace(-10., 9.9, 3*32).reshape(3, 32)
+        data_array = self.fastino.voltage_group_to_mu_array(voltage)
+        self.assertEqual(data_array.shape, (3, 16))
+        for row, data_row in zip(voltage, data_array):
+            np.testing.assert_array_equal(
+                data_row, self.fastino.voltage_group_to_mu_array(row))
+
+    def test_voltage_group_to_mu_array_reuse(self):
+        data = np.empty(16, dtype=np.int32)
+        for v in (-1., 0., 5.):
+            voltage = np.full(32, v)
+            result = self.fastino.voltage_group_to_mu_array(voltage, data)
+            self.assertIs(result, data)
+            np.testing.assert_array_equal(
+                data, self.fastino.voltage_group_to_mu_array(voltage))
+        with self.assertRaises(ValueError):
+            self.fastino.voltage_group_to_mu_array(
+                np.zeros(32), np.empty(8, dtype=np.int32))
+
+    def test_voltage_group_to_mu_odd(self):
+        with self.assertRaises(ValueError):
+            self.fastino.voltage_group_to_mu([0.]*31, [int32(0)]*16)
+        with self.assertRaises(ValueError):
+            self.fastino.voltage_group_to_mu_array(np.zeros(31))
+
+    def test_build_mu_table(self):
+        voltage = np.linspace(-10., 9.9, 101)
+        np.testing.assert_array_equal(
+            self.fastino.build_mu_table(voltage),
+            [self.fastino.voltage_to_mu(v) for v in voltage])
+
+    def test_out_of_bounds(self):
+        for v in (-10.001, 10.):
+            with self.assertRaises(ValueError):
+                self.fastino.voltage_to_mu(v)
+            with self.assertRaises(ValueError):
+                self.fastino.build_mu_table(np.array([0., v]))
+            with self.assertRaises(ValueError):
+                self.fastino.voltage_group_to_mu_array(np.array([0., v]))